@@ -1,7 +1,9 @@
 import json
+import httpx
 from dotenv import dotenv_values
-from groq import Groq
+from groq import BadRequestError, Groq
 from utils import (
+    cached_completion,
     get_reference_extra_desc,
     get_reference_proposed,
     get_reference_no_types,
@@ -9,7 +11,23 @@ from utils import (
 
 
 config = dotenv_values(".env")
-client = Groq(api_key=config["GROQ_API_KEY"])
+
+# One shared HTTP/2 client so concurrent workers reuse pooled connections
+# instead of paying a TLS handshake per query; keep-alive slots must cover
+# the largest --workers value in use
+http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+    timeout=httpx.Timeout(60.0, connect=5.0),
+)
+# The SDK already retries 429s and transient errors with exponential backoff,
+# honouring Retry-After; raise the attempt count so bursts of concurrent
+# queries wait out the rate limit instead of being logged as empty programs
+client = Groq(
+    api_key=config["GROQ_API_KEY"],
+    http_client=http_client,
+    max_retries=6,
+)
 
 
 SYSTEM_F = (
@@ -70,6 +88,15 @@ The Edge type is
 OTHERNODEID is the NODEID this current node is connected to via the port with id that matches the one specified in portID. An outPort connects to an inPort; an outPort cannot connect to another outPort, and an inPort cannot connect to another inPort. A Constant node has only one port, and it is an outPort: VALUE. A `field` of a node can be considered an inPort for the purposes of an Edge. Port connections must be defined in the `edges` list for both the to and from nodes."""
 )
 
+SYSTEM_BATCH = """
+
+## Multiple Queries
+
+Instead of a single **User Query**, you may be given several numbered queries (**Query 0**, **Query 1**, ...). Generate one graph per query, each independent of the others and each in the output format above. Your output must then be a JSON object in the following format:
+{"results": List[Graph]}
+
+where the i-th element of `results` is the graph for **Query i**."""
+
 MODEL_MAP = {
     "gpt": "openai/gpt-oss-120b",
     "qwen": "qwen/qwen3-32b",
@@ -84,102 +111,154 @@ REASONING_MAP = {
     "llama": None,
 }
 
+MAX_COMPLETION_TOKENS = 8192
 
-def agent_proposed(query: str, model_choice: str) -> str:
-    user_message = f"**User Query**: {query}"
-
-    REF = get_reference_proposed()
+# Per-request completion caps on Groq; a larger max_completion_tokens is
+# rejected with a 400, so batched budgets are clamped to these
+MAX_COMPLETION_BY_MODEL = {
+    "gpt": 65536,
+    "qwen": 40960,
+    "deepseek": 131072,
+    "llama": 32768,
+}
 
-    SYSTEM = SYSTEM_F(json.dumps(REF, indent=2))
 
-    completion = client.chat.completions.create(
-        model=MODEL_MAP[model_choice],
-        messages=[
-            {"role": "system", "content": SYSTEM},
-            {"role": "user", "content": user_message},
-        ],
-        temperature=1,
-        max_completion_tokens=8192,
-        top_p=1,
-        reasoning_effort=REASONING_MAP[model_choice],
-        stream=False,
-        response_format={"type": "json_object"},
-        stop=None,
-    )
+# The node reference makes up almost all of the prompt, so each variant is
+# rendered once at import and always sent as the leading system message,
+# byte-for-byte identical across queries. Per-query text only goes in the
+# trailing user message, which keeps the shared prefix as long as possible for
+# provider-side prompt caching. Building these eagerly also means concurrent
+# first calls never race to render the same prompt.
+_REF_PROPOSED_STR = json.dumps(get_reference_proposed(), indent=2)
+_REF_EXTRA_DESC_STR = json.dumps(get_reference_extra_desc(), indent=2)
+_REF_NO_TYPES_STR = json.dumps(get_reference_no_types(), indent=2)
+
+_SYSTEM_PROPOSED = SYSTEM_F(_REF_PROPOSED_STR)
+_SYSTEM_EXTRA_DESC = SYSTEM_F(_REF_EXTRA_DESC_STR)
+_SYSTEM_NO_TYPES = SYSTEM_F(_REF_NO_TYPES_STR)
+_SYSTEM_ALT = SYSTEM_ALT_F(_REF_PROPOSED_STR)
+
+_SYSTEM_BY_REPR = {
+    "proposed": _SYSTEM_PROPOSED,
+    "extra_desc": _SYSTEM_EXTRA_DESC,
+    "no_types": _SYSTEM_NO_TYPES,
+    "alternative": _SYSTEM_ALT,
+}
 
-    return completion.choices[0].message.content
+_SYSTEM_BATCH_BY_REPR = {
+    repr_choice: system + SYSTEM_BATCH
+    for repr_choice, system in _SYSTEM_BY_REPR.items()
+}
 
 
-def agent_no_types(query: str, model_choice: str) -> str:
-    user_message = f"**User Query**: {query}"
+# Requests are made with stream=False: Groq does not support streaming together
+# with JSON mode (response_format), and the graph can only be parsed once the
+# whole object has arrived anyway. Network waits are instead overlapped by
+# running queries concurrently (see main.py).
+def complete(use_cache: bool = True, **params) -> str:
+    # Sampling at temperature > 0 is part of the experiment, so only
+    # deterministic requests are answered from the on-disk cache
+    if use_cache and params["temperature"] == 0:
+        return cached_completion(client.chat.completions.create, params)
 
-    REF = get_reference_no_types()
+    completion = client.chat.completions.create(**params)
+    return completion.choices[0].message.content
 
-    SYSTEM = SYSTEM_F(json.dumps(REF, indent=2))
 
-    completion = client.chat.completions.create(
+def is_truncated_json(error: Exception) -> bool:
+    # In JSON mode Groq validates the output itself and answers an unparsable
+    # (typically cut-off) graph with a 400 json_validate_failed error
+    if isinstance(error, BadRequestError):
+        body = error.body
+        if isinstance(body, dict):
+            body = body.get("error", body)
+        # The error payload is not always an object (e.g. a bare message)
+        if not isinstance(body, dict):
+            return False
+        return body.get("code") == "json_validate_failed"
+    return isinstance(error, json.JSONDecodeError)
+
+
+def _call_agent(
+    system: str,
+    user_message: str,
+    model_choice: str,
+    temperature: float,
+    use_cache: bool,
+    max_tokens: int,
+) -> str:
+    return complete(
         model=MODEL_MAP[model_choice],
         messages=[
-            {"role": "system", "content": SYSTEM},
+            {"role": "system", "content": system},
             {"role": "user", "content": user_message},
         ],
-        temperature=1,
-        max_completion_tokens=8192,
+        temperature=temperature,
+        max_completion_tokens=max_tokens,
         top_p=1,
         reasoning_effort=REASONING_MAP[model_choice],
         stream=False,
         response_format={"type": "json_object"},
         stop=None,
+        use_cache=use_cache,
     )
 
-    return completion.choices[0].message.content
-
 
-def agent_extra_desc(query: str, model_choice: str) -> str:
+def agent(
+    repr_choice: str,
+    query: str,
+    model_choice: str,
+    temperature: float = 1,
+    use_cache: bool = True,
+    max_tokens: int = MAX_COMPLETION_TOKENS,
+) -> str:
     user_message = f"**User Query**: {query}"
 
-    REF = get_reference_extra_desc()
+    return _call_agent(
+        _SYSTEM_BY_REPR[repr_choice],
+        user_message,
+        model_choice,
+        temperature,
+        use_cache,
+        max_tokens,
+    )
 
-    SYSTEM = SYSTEM_F(json.dumps(REF, indent=2))
 
-    completion = client.chat.completions.create(
-        model=MODEL_MAP[model_choice],
-        messages=[
-            {"role": "system", "content": SYSTEM},
-            {"role": "user", "content": user_message},
-        ],
-        temperature=1,
-        max_completion_tokens=8192,
-        top_p=1,
-        reasoning_effort=REASONING_MAP[model_choice],
-        stream=False,
-        response_format={"type": "json_object"},
-        stop=None,
+def agent_batch(
+    repr_choice: str,
+    queries: list[str],
+    model_choice: str,
+    temperature: float = 1,
+    use_cache: bool = True,
+    max_tokens: int = MAX_COMPLETION_TOKENS,
+) -> str:
+    user_message = "\n\n".join(f"**Query {i}**: {q}" for i, q in enumerate(queries))
+
+    return _call_agent(
+        _SYSTEM_BATCH_BY_REPR[repr_choice],
+        user_message,
+        model_choice,
+        temperature,
+        use_cache,
+        min(max_tokens * len(queries), MAX_COMPLETION_BY_MODEL[model_choice]),
     )
 
-    return completion.choices[0].message.content
 
+def agent_proposed(query: str, model_choice: str, **kwargs) -> str:
+    return agent("proposed", query, model_choice, **kwargs)
 
-def agent_alternative(query: str, model_choice: str) -> str:
-    user_message = f"**User Query**: {query}"
 
-    REF = get_reference_proposed()
+def agent_no_types(query: str, model_choice: str, **kwargs) -> str:
+    return agent("no_types", query, model_choice, **kwargs)
 
-    SYSTEM = SYSTEM_ALT_F(json.dumps(REF, indent=2))
 
-    completion = client.chat.completions.create(
-        model=MODEL_MAP[model_choice],
-        messages=[
-            {"role": "system", "content": SYSTEM},
-            {"role": "user", "content": user_message},
-        ],
-        temperature=1,
-        max_completion_tokens=8192,
-        top_p=1,
-        reasoning_effort=REASONING_MAP[model_choice],
-        stream=False,
-        response_format={"type": "json_object"},
-        stop=None,
-    )
+def agent_extra_desc(query: str, model_choice: str, **kwargs) -> str:
+    return agent("extra_desc", query, model_choice, **kwargs)
 
-    return completion.choices[0].message.content
+
+def agent_alternative(query: str, model_choice: str, **kwargs) -> str:
+    return agent("alternative", query, model_choice, **kwargs)
+
+
+def agent_proposed_batch(queries: list[str], model_choice: str, **kwargs) -> str:
+    return agent_batch("proposed", queries, model_choice, **kwargs)
@@ -1,13 +1,19 @@
+import os
+import sys
 import json
+import orjson
 import subprocess
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from pathlib import Path
 from datetime import datetime
 from argparse import ArgumentParser
 
 from scratch import *
-from agents import agent_no_types, agent_proposed, agent_alternative, agent_extra_desc
+from agents import agent, agent_batch, is_truncated_json, MAX_COMPLETION_TOKENS
 from utils import (
+    build_edge_index,
     topological_sort,
     get_arg_val,
     get_substack_blocks,
@@ -16,113 +22,192 @@ from utils import (
     get_reference_proposed,
 )
 
+REF = get_reference_proposed()
 
-def pipeline(repr_choice, model_choice, query, filepath, logpath):
+
+def _node_ports(name, node):
+    # The (port id, constructor argument) pairs for the node's inPorts and
+    # fields; EXEC is wired with connect_next instead
+    ports = tuple(
+        (port["id"], port["id"].lower())
+        for port in node["inPorts"] + node["fields"]
+        if port["id"] != "EXEC"
+    )
+    outs = tuple(port["id"] for port in node["outPorts"])
+    args = ", ".join(f"{arg_name}={{{arg_name}}}" for _, arg_name in ports)
+    template = f"{{node_id}} = {name}Block({args})"
+    return ports, outs, template
+
+
+# Per node name: its constructor ports, outPort ids and a format template for
+# the line that instantiates it
+_PORT_CACHE = {name: _node_ports(name, node) for name, node in REF.items()}
+
+PROGRAM_HEADER = """\
+import sys
+import os
+project_root = os.path.join(os.path.dirname(__file__), '../../../')
+resolved_path = os.path.abspath(project_root)
+sys.path.append(resolved_path)
+from scratch import *
+program = ScratchProgram()"""
+
+
+def pipeline(
+    agent_fn,
+    post,
+    model_choice,
+    query,
+    filepath,
+    logpath,
+    temperature=1,
+    use_cache=True,
+    max_tokens=MAX_COMPLETION_TOKENS,
+):
+    agent_args = {
+        "temperature": temperature,
+        "use_cache": use_cache,
+        "max_tokens": max_tokens,
+    }
     try:
-        match repr_choice:
-            case "proposed":
-                graph = json.loads(agent_proposed(query, model_choice))
-            case "extra_desc":
-                graph = json.loads(agent_extra_desc(query, model_choice))
-            case "no_types":
-                graph = json.loads(agent_no_types(query, model_choice))
-            case "alternative":
-                graph_raw = json.loads(agent_alternative(query, model_choice))
-                graph = convert_repr(graph_raw, get_reference_proposed())
-
-        ordered_ids = topological_sort(graph)
-
-        with open(logpath, "a") as f:
-            f.write(f"{json.dumps(graph, indent=2)}\n\n")
-
-        has_substack, has_substack_else = [], []
-
-        program = []
-
-        program.append("import sys")
-        program.append("import os")
-        program.append(
-            "project_root = os.path.join(os.path.dirname(__file__), '../../../')"
-        )
-        program.append("resolved_path = os.path.abspath(project_root)")
-        program.append("sys.path.append(resolved_path)")
-        program.append("from scratch import *")
-        program.append("program = ScratchProgram()")
-
-        # Create blocks
-        for id in ordered_ids:
-            name = graph["nodes"][id]["name"]
-            if name == "Constant":
-                val = graph["nodes"][id]["value"]
-                if isinstance(val, str):
-                    program.append(f"{id} = '{val}'")
-                else:
-                    program.append(f"{id} = {val}")
-                continue
-
-            params = []
-            ins, fields = REF[name]["inPorts"], REF[name]["fields"]
-            ports = ins + fields
-            for port in ports:
-                port_id = port["id"]
-                if port_id == "EXEC":
-                    continue
-                params.append(
-                    f"{port_id.lower()}={get_arg_val(id, port_id, graph['edges'])}"
-                )
-
-            outs = REF[name]["outPorts"]
-            for port in outs:
-                port_id = port["id"]
-                if port_id == "SUBSTACK" or port_id == "SUBSTACK_IF":
-                    has_substack.append(id)
-                elif port_id == "SUBSTACK_ELSE":
-                    has_substack_else.append(id)
-
-            program.append(f"{id} = {name}Block({', '.join(params)})")
-
-        # Add substacks
-        for id in has_substack:
-            blocks = get_substack_blocks(id, graph["edges"])
-            for block in blocks:
-                program.append(f"{id}.add_to_substack({block})")
-
-        for id in has_substack_else:
-            blocks = get_substackelse_blocks(id, graph["edges"])
-            for block in blocks:
-                program.append(f"{id}.add_to_else_substack({block})")
-
-        # Connect blocks
-        for e in graph["edges"]:
-            if e["outPortID"] == "THEN" and e["inPortID"] == "EXEC":
-                program.append(f"{e['outNodeID']}.connect_next({e['inNodeID']})")
-
-        # Add script to program
-        for id in ordered_ids:
-            name = graph["nodes"][id]["name"]
-            if name == "WhenFlagClicked" or name == "WhenKeyPressed":
-                program.append(f"program.add_script({id})")
-                break
-
-        # Execute program
-        program.append("results, final_context = program.execute()")
-
-        program.append(f"with open('{logpath}', 'a') as f:")
-        program.append("    f.write(f'{results}')")
-        program.append(f"with open('{logpath}', 'a') as f:")
-        program.append("    f.write(f'{final_context}')")
-
-        with open(filepath, "w") as f:
-            program_str = "\n".join(program)
-            f.write(program_str)
+        try:
+            graph = orjson.loads(agent_fn(query, model_choice, **agent_args))
+        except Exception as e:
+            # A tight token budget can cut the graph off mid-object, so retry
+            # once with the full budget before giving up
+            if max_tokens >= MAX_COMPLETION_TOKENS or not is_truncated_json(e):
+                raise
+            agent_args["max_tokens"] = MAX_COMPLETION_TOKENS
+            graph = orjson.loads(agent_fn(query, model_choice, **agent_args))
+
+        generate_program(post(graph), filepath, logpath)
 
     except Exception as e:
-        error_message = f"GRAPH GEN ERROR: {filepath} is thus empty. {e}"
-        print(error_message)
-        with open(logpath, "w") as f:
-            f.write(error_message)
-        with open(filepath, "w") as f:
-            f.write("")
+        log_error(filepath, logpath, e)
+
+
+def pipeline_batch(
+    agent_fn,
+    post,
+    model_choice,
+    queries,
+    filepaths,
+    logpaths,
+    temperature=1,
+    use_cache=True,
+    max_tokens=MAX_COMPLETION_TOKENS,
+):
+    agent_args = {
+        "temperature": temperature,
+        "use_cache": use_cache,
+        "max_tokens": max_tokens,
+    }
+    try:
+        try:
+            response = agent_fn(queries, model_choice, **agent_args)
+            graphs = orjson.loads(response)["results"]
+        except Exception as e:
+            if max_tokens >= MAX_COMPLETION_TOKENS or not is_truncated_json(e):
+                raise
+            agent_args["max_tokens"] = MAX_COMPLETION_TOKENS
+            response = agent_fn(queries, model_choice, **agent_args)
+            graphs = orjson.loads(response)["results"]
+        if len(graphs) != len(queries):
+            raise ValueError(f"Expected {len(queries)} graphs, got {len(graphs)}")
+    except Exception as e:
+        for filepath, logpath in zip(filepaths, logpaths):
+            log_error(filepath, logpath, e)
+        return
+
+    for graph, filepath, logpath in zip(graphs, filepaths, logpaths):
+        try:
+            generate_program(post(graph), filepath, logpath)
+        except Exception as e:
+            log_error(filepath, logpath, e)
+
+
+def generate_program(graph, filepath, logpath):
+    ordered_ids = topological_sort(graph)
+
+    # Index the edges once instead of rescanning them for every port lookup
+    by_out, by_in = build_edge_index(graph["edges"])
+    next_edges = [
+        e
+        for e in graph["edges"]
+        if e["outPortID"] == "THEN" and e["inPortID"] == "EXEC"
+    ]
+    exec_map = {e["outNodeID"]: e["inNodeID"] for e in next_edges}
+
+    with open(logpath, "a") as f:
+        f.write(f"{json.dumps(graph, indent=2)}\n\n")
+
+    has_substack, has_substack_else = [], []
+
+    program = [PROGRAM_HEADER]
+
+    # Create blocks
+    for id in ordered_ids:
+        name = graph["nodes"][id]["name"]
+        if name == "Constant":
+            # repr quotes and escapes strings safely and matches str() for
+            # the other scalar values a Constant can hold
+            program.append(f"{id} = {graph['nodes'][id]['value']!r}")
+            continue
+
+        ports, outs, template = _PORT_CACHE[name]
+
+        args = {
+            arg_name: get_arg_val(id, port_id, by_in) for port_id, arg_name in ports
+        }
+
+        for port_id in outs:
+            if port_id == "SUBSTACK" or port_id == "SUBSTACK_IF":
+                has_substack.append(id)
+            elif port_id == "SUBSTACK_ELSE":
+                has_substack_else.append(id)
+
+        program.append(template.format(node_id=id, **args))
+
+    # Add substacks
+    for id in has_substack:
+        blocks = get_substack_blocks(id, by_out, exec_map)
+        for block in blocks:
+            program.append(f"{id}.add_to_substack({block})")
+
+    for id in has_substack_else:
+        blocks = get_substackelse_blocks(id, by_out, exec_map)
+        for block in blocks:
+            program.append(f"{id}.add_to_else_substack({block})")
+
+    # Connect blocks
+    for e in next_edges:
+        program.append(f"{e['outNodeID']}.connect_next({e['inNodeID']})")
+
+    # Add script to program
+    for id in ordered_ids:
+        name = graph["nodes"][id]["name"]
+        if name == "WhenFlagClicked" or name == "WhenKeyPressed":
+            program.append(f"program.add_script({id})")
+            break
+
+    # Execute program
+    program.append("results, final_context = program.execute()")
+
+    program.append(f"with open('{logpath}', 'a') as f:")
+    program.append("    f.write(f'{results}{final_context}')")
+
+    with open(filepath, "w") as f:
+        program_str = "\n".join(program)
+        f.write(program_str)
+
+
+def log_error(filepath, logpath, e):
+    error_message = f"GRAPH GEN ERROR: {filepath} is thus empty. {e}"
+    print(error_message)
+    with open(logpath, "w") as f:
+        f.write(error_message)
+    with open(filepath, "w") as f:
+        f.write("")
 
 
 def get_args():
@@ -148,15 +233,51 @@ def get_args():
         required=True,
         choices=["batch_1", "batch_2", "batch_3", "batch_4"],
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=16,
+        help="number of queries sent to the API concurrently",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        dest="batch_size",
+        type=int,
+        default=1,
+        help="number of queries answered per API request",
+    )
+    parser.add_argument(
+        "--temperature",
+        dest="temperature",
+        type=float,
+        default=1,
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="always call the API, even for temperature 0 requests seen before",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        dest="max_tokens",
+        type=int,
+        default=MAX_COMPLETION_TOKENS,
+        help="completion token budget per query (includes reasoning tokens); "
+        f"truncated responses are retried once with {MAX_COMPLETION_TOKENS}",
+    )
     args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
     return args
 
 
 if __name__ == "__main__":
     args = get_args()
 
-    REF = get_reference_proposed()
-
     with open(f"tests/{args.test}.txt") as f:
         queries = f.read().strip().split("\n")
 
@@ -164,17 +285,79 @@ if __name__ == "__main__":
     timestamp = f"{today.year}{today.month:02}{today.day:02}{today.hour:02}{today.minute:02}{today.second:02}"
     dir = Path(f"out/{args.repr}-{args.model}-{args.test}-{timestamp}")
 
-    for i in tqdm(range(len(queries))):
-        dirr = dir / f"{i+1}"
-        dirr.mkdir(parents=True, exist_ok=True)
-
-        filepath = dirr / f"out.py"
-        logpath = dirr / f"log.txt"
-
-        pipeline(args.repr, args.model, queries[i], filepath, logpath)
-
-    for i in tqdm(range(len(queries))):
-        filepath = dir / f"{i+1}" / f"out.py"
-        subprocess.run(["python", filepath])
+    # Resolve the representation once instead of dispatching on it per query;
+    # alternative graphs are converted to the proposed form before codegen
+    agent_fn = partial(agent, args.repr)
+    batch_agent_fn = partial(agent_batch, args.repr)
+    if args.repr == "alternative":
+        post = partial(convert_repr, node_reference=REF)
+    else:
+        post = lambda graph: graph
+
+    def run_one(batch):
+        filepaths, logpaths = [], []
+        for i in batch:
+            dirr = dir / f"{i+1}"
+            dirr.mkdir(parents=True, exist_ok=True)
+
+            filepaths.append(dirr / f"out.py")
+            logpaths.append(dirr / f"log.txt")
+
+        if args.batch_size > 1:
+            batch_queries = [queries[i] for i in batch]
+            pipeline_batch(
+                batch_agent_fn,
+                post,
+                args.model,
+                batch_queries,
+                filepaths,
+                logpaths,
+                temperature=args.temperature,
+                use_cache=args.use_cache,
+                max_tokens=args.max_tokens,
+            )
+        else:
+            pipeline(
+                agent_fn,
+                post,
+                args.model,
+                queries[batch[0]],
+                filepaths[0],
+                logpaths[0],
+                temperature=args.temperature,
+                use_cache=args.use_cache,
+                max_tokens=args.max_tokens,
+            )
+
+        return filepaths
+
+    batches = [
+        range(i, min(i + args.batch_size, len(queries)))
+        for i in range(0, len(queries), args.batch_size)
+    ]
+
+    # Generated programs only import scratch (stdlib-only) from the project
+    # root they add to sys.path themselves, so the interpreter can start in
+    # isolated mode without site initialization
+    def run_program(filepath):
+        subprocess.run([sys.executable, "-I", "-S", filepath])
+
+    # Each request is independent and bound by the API round-trip, so the
+    # requests are issued concurrently (the Groq client is thread-safe). The
+    # generated programs run on a separate pool sized to the cores, each one
+    # starting as soon as its own request has been turned into code; threads
+    # are enough there since each one just waits on its child process
+    with (
+        ThreadPoolExecutor(max_workers=args.workers) as generator,
+        ThreadPoolExecutor(max_workers=os.cpu_count()) as runner,
+    ):
+        futures = [generator.submit(run_one, batch) for batch in batches]
+        runs = []
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            for filepath in future.result():
+                runs.append(runner.submit(run_program, filepath))
+
+        for run in tqdm(as_completed(runs), total=len(runs)):
+            run.result()
 
     print(f"Results saved in {dir}")
@@ -1,34 +1,141 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict, Optional, Union
-from enum import Enum
-import uuid
+from typing import Any, Callable, Dict, List, Optional, Union
+from enum import IntEnum
+import itertools
 import random
 import math
+from math import radians, cos, sin
 
+# Stack, hat and C-blocks return a human-readable trace of what they did, which
+# ScratchProgram.execute collects into its results; set to False to skip
+# building those strings when only the final context is needed
+TRACE = True
 
-class BlockType(Enum):
+# Block ids only need to be unique within a run; they are stringified when the
+# program is serialized
+_id_counter = itertools.count()
+
+
+def make_context() -> Dict[str, Any]:
+    """Create the initial sprite state; motion and looks blocks index these
+    keys directly, so every context passed to execute must contain them"""
+    return {"x": 0, "y": 0, "direction": 0, "size": 100}
+
+
+class BlockType(IntEnum):
     """Types of Scratch blocks"""
 
-    HAT = "hat"
-    STACK = "stack"
-    BOOLEAN = "boolean"
-    REPORTER = "reporter"
-    C_BLOCK = "c_block"
-    CAP = "cap"
+    HAT = 0
+    STACK = 1
+    BOOLEAN = 2
+    REPORTER = 3
+    C_BLOCK = 4
+    CAP = 5
+
+
+# Names used for the block type when a program is serialized
+_BT_NAMES = {
+    BlockType.HAT: "hat",
+    BlockType.STACK: "stack",
+    BlockType.BOOLEAN: "boolean",
+    BlockType.REPORTER: "reporter",
+    BlockType.C_BLOCK: "c_block",
+    BlockType.CAP: "cap",
+}
+
+
+def _run_substack(fns, context):
+    """Execute a substack's bound execute methods in order and collect each
+    block's result"""
+    if TRACE:
+        return [fn(context) for fn in fns]
+    for fn in fns:
+        fn(context)
+
+
+# Inputs are almost always plain literals or blocks. isinstance against the
+# ScratchBlock ABC goes through ABCMeta, so the literal types are ruled out
+# with a set lookup on the exact class first
+_LITERAL_TYPES = frozenset({int, float, str, bool, type(None)})
+
+
+def _is_block(value: Any) -> bool:
+    """Whether an input value is a block rather than a literal"""
+    return value.__class__ not in _LITERAL_TYPES and isinstance(value, ScratchBlock)
+
+
+def _literal_int(value: Any) -> Optional[int]:
+    """Cast a literal input to int once at construction; None means the cast
+    has to happen on every execute (block inputs and non-numeric literals)"""
+    if _is_block(value):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+# Marks a pure reporter whose value has not been computed yet
+_UNSET = object()
 
 
 class ScratchBlock(ABC):
     """Base class for all Scratch blocks"""
 
-    def __init__(self, opcode: str, block_type: BlockType):
-        self.id = str(uuid.uuid4())
+    # Set on value blocks whose result depends on more than their inputs
+    # (sprite state, variables, input devices or randomness)
+    IS_IMPURE = False
+
+    # Inputs the schema types as blocks only (conditions and boolean operands)
+    BLOCK_INPUTS = frozenset()
+
+    # Only C-blocks have substacks; they shadow these with per-instance lists
+    substack = ()
+    substack2 = ()
+
+    __slots__ = (
+        "id",
+        "opcode",
+        "block_type",
+        "inputs",
+        "_resolved_inputs",
+        "fields",
+        "next_block",
+        "parent",
+        "_consumers",
+        "_pure",
+        "_value",
+    )
+
+    def __init__(
+        self,
+        opcode: str,
+        block_type: BlockType,
+        inputs: Optional[Dict[str, Any]] = None,
+        fields: Optional[Dict[str, Any]] = None,
+    ):
+        self.id = next(_id_counter)
         self.opcode = opcode
         self.block_type = block_type
-        self.inputs = {}
-        self.fields = {}
+        self.inputs = dict(inputs) if inputs else {}
+        # Per input, a callable taking the context and returning its value,
+        # so execute never has to check whether an input is a block
+        self._resolved_inputs = {}
+        self.fields = dict(fields) if fields else {}
         self.next_block = None
         self.parent = None
-        self.children = []
+        # Every block reading this one as an input; parent is only the last
+        self._consumers = []
+        for name, value in self.inputs.items():
+            self._resolve_input(name, value)
+        # Reporters and booleans built only from literals and other pure
+        # blocks return the same value every time, so it is computed once
+        self._pure = (
+            block_type in (BlockType.REPORTER, BlockType.BOOLEAN)
+            and not self.IS_IMPURE
+            and all(value._pure for value in self.inputs.values() if _is_block(value))
+        )
+        self._value = _UNSET
 
     @abstractmethod
     def execute(self, context: Dict[str, Any]) -> Any:
@@ -44,9 +151,55 @@ class ScratchBlock(ABC):
     def add_input(self, name: str, value: Union["ScratchBlock", Any]):
         """Add an input to this block"""
         self.inputs[name] = value
-        if isinstance(value, ScratchBlock):
+        self._resolve_input(name, value)
+        impure = _is_block(value) and not value._pure
+        # The new input invalidates the memoized value of this block and of
+        # every pure block consuming it, and an impure one taints them all
+        stack = [self]
+        seen = set()
+        while stack:
+            block = stack.pop()
+            if not block._pure or block.id in seen:
+                continue
+            seen.add(block.id)
+            if impure:
+                block._pure = False
+            block._value = _UNSET
+            stack.extend(block._consumers)
+
+    def _resolve_input(self, name: str, value: Union["ScratchBlock", Any]):
+        """Bind how an input is evaluated and adopt it if it is a block"""
+        if _is_block(value):
+            if value._pure:
+                self._resolved_inputs[name] = value._execute_once
+            else:
+                self._resolved_inputs[name] = value.execute
             value.parent = self
-            self.children.append(value)
+            value._consumers.append(self)
+        elif name in self.BLOCK_INPUTS:
+            # A literal or missing input on a block-only port must still fail
+            # when the block runs, so malformed graphs are not scored as working
+            self._resolved_inputs[name] = lambda context, v=value: v.execute(context)
+        else:
+            self._resolved_inputs[name] = lambda context, value=value: value
+
+    def _execute_once(self, context: Dict[str, Any]) -> Any:
+        """Execute a pure block on first use and reuse its value afterwards"""
+        # Parents keep this bound after add_input makes the block impure
+        if not self._pure:
+            return self.execute(context)
+        if self._value is _UNSET:
+            self._value = self.execute(context)
+        return self._value
+
+    @property
+    def children(self) -> List["ScratchBlock"]:
+        """Blocks nested in this one: block inputs, then substack contents"""
+        return [
+            *(value for value in self.inputs.values() if _is_block(value)),
+            *self.substack,
+            *self.substack2,
+        ]
 
     def add_field(self, name: str, value: Any):
         """Add a field to this block"""
@@ -55,82 +208,110 @@ class ScratchBlock(ABC):
     def to_dict(self) -> Dict[str, Any]:
         """Convert block to dictionary representation"""
         return {
-            "id": self.id,
+            "id": str(self.id),
             "opcode": self.opcode,
-            "type": self.block_type.value,
+            "type": _BT_NAMES[self.block_type],
             "inputs": {
-                k: v.id if isinstance(v, ScratchBlock) else v
-                for k, v in self.inputs.items()
+                k: (str(v.id) if _is_block(v) else v) for k, v in self.inputs.items()
             },
             "fields": self.fields,
-            "next": self.next_block.id if self.next_block else None,
-            "parent": self.parent.id if self.parent else None,
+            "next": str(self.next_block.id) if self.next_block else None,
+            "parent": str(self.parent.id) if self.parent else None,
         }
 
 
 class WhenFlagClickedBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__("event_whenflagclicked", BlockType.HAT)
 
     def execute(self, context):
-        return "Program started"
+        return "Program started" if TRACE else None
 
 
 class WhenKeyPressedBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, key_option: str):
-        super().__init__("event_whenkeypressed", BlockType.HAT)
-        self.add_field("KEY_OPTION", key_option)
+        super().__init__(
+            "event_whenkeypressed", BlockType.HAT, fields={"KEY_OPTION": key_option}
+        )
 
     def execute(self, context):
-        return f"Key {self.fields['KEY_OPTION']} pressed"
+        return f"Key {self.fields['KEY_OPTION']} pressed" if TRACE else None
+
+
+# Turn and point blocks keep direction as an int in [0, 360), so moves can look
+# the heading up instead of recomputing the trig
+_DIR_COS = tuple(cos(radians(d)) for d in range(360))
+_DIR_SIN = tuple(sin(radians(d)) for d in range(360))
 
 
 class MoveStepsBlock(ScratchBlock):
+    __slots__ = ("_steps_int",)
+
     def __init__(self, steps: Union[int, "ScratchBlock"]):
-        super().__init__("motion_movesteps", BlockType.STACK)
-        self.add_input("STEPS", steps)
+        super().__init__("motion_movesteps", BlockType.STACK, inputs={"STEPS": steps})
+        self._steps_int = _literal_int(steps)
 
     def execute(self, context):
-        steps = self.inputs["STEPS"]
-        if isinstance(steps, ScratchBlock):
-            steps = steps.execute(context)
+        steps = self._resolved_inputs["STEPS"](context)
+        steps_int = self._steps_int if self._steps_int is not None else int(steps)
 
-        direction_rad = math.radians(context.get("direction", 0))
-        dx = int(steps) * math.cos(direction_rad)
-        dy = int(steps) * math.sin(direction_rad)
+        direction = context["direction"]
+        if direction.__class__ is int and 0 <= direction < 360:
+            cos_d, sin_d = _DIR_COS[direction], _DIR_SIN[direction]
+        else:
+            direction_rad = radians(direction)
+            cos_d, sin_d = cos(direction_rad), sin(direction_rad)
+        dx = steps_int * cos_d
+        dy = steps_int * sin_d
 
-        context["x"] = context.get("x", 0) + dx
-        context["y"] = context.get("y", 0) + dy
-        return f"Moved {steps} steps"
+        context["x"] = context["x"] + dx
+        context["y"] = context["y"] + dy
+        return f"Moved {steps} steps" if TRACE else None
 
 
 class TurnRightBlock(ScratchBlock):
+    __slots__ = ("_degrees_int",)
+
     def __init__(self, degrees: Union[int, "ScratchBlock"]):
-        super().__init__("motion_turnright", BlockType.STACK)
-        self.add_input("DEGREES", degrees)
+        super().__init__(
+            "motion_turnright", BlockType.STACK, inputs={"DEGREES": degrees}
+        )
+        self._degrees_int = _literal_int(degrees)
 
     def execute(self, context):
-        degrees = self.inputs["DEGREES"]
-        if isinstance(degrees, ScratchBlock):
-            degrees = degrees.execute(context)
-        context["direction"] = (context.get("direction", 0) + int(degrees)) % 360
-        return f"Turned right {degrees} degrees"
+        degrees = self._resolved_inputs["DEGREES"](context)
+        degrees_int = (
+            self._degrees_int if self._degrees_int is not None else int(degrees)
+        )
+        context["direction"] = (context["direction"] + degrees_int) % 360
+        return f"Turned right {degrees} degrees" if TRACE else None
 
 
 class TurnLeftBlock(ScratchBlock):
+    __slots__ = ("_degrees_int",)
+
     def __init__(self, degrees: Union[int, "ScratchBlock"]):
-        super().__init__("motion_turnleft", BlockType.STACK)
-        self.add_input("DEGREES", degrees)
+        super().__init__(
+            "motion_turnleft", BlockType.STACK, inputs={"DEGREES": degrees}
+        )
+        self._degrees_int = _literal_int(degrees)
 
     def execute(self, context):
-        degrees = self.inputs["DEGREES"]
-        if isinstance(degrees, ScratchBlock):
-            degrees = degrees.execute(context)
-        context["direction"] = (context.get("direction", 0) - int(degrees)) % 360
-        return f"Turned left {degrees} degrees"
+        degrees = self._resolved_inputs["DEGREES"](context)
+        degrees_int = (
+            self._degrees_int if self._degrees_int is not None else int(degrees)
+        )
+        context["direction"] = (context["direction"] - degrees_int) % 360
+        return f"Turned left {degrees} degrees" if TRACE else None
 
 
 class GoToRandomBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__("motion_goto_random", BlockType.STACK)
 
@@ -139,400 +320,421 @@ class GoToRandomBlock(ScratchBlock):
         y = random.randint(-180, 180)
         context["x"] = x
         context["y"] = y
-        return f"Moved to random position ({x}, {y})"
+        return f"Moved to random position ({x}, {y})" if TRACE else None
 
 
 class GotoXYBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, x: Union[int, "ScratchBlock"], y: Union[int, "ScratchBlock"]):
-        super().__init__("motion_gotoxy", BlockType.STACK)
-        self.add_input("X", x)
-        self.add_input("Y", y)
+        super().__init__("motion_gotoxy", BlockType.STACK, inputs={"X": x, "Y": y})
 
     def execute(self, context):
-        x = self.inputs["X"]
-        y = self.inputs["Y"]
-        if isinstance(x, ScratchBlock):
-            x = x.execute(context)
-        if isinstance(y, ScratchBlock):
-            y = y.execute(context)
+        x = self._resolved_inputs["X"](context)
+        y = self._resolved_inputs["Y"](context)
         context["x"] = int(x)
         context["y"] = int(y)
-        return f"Moved to ({x}, {y})"
+        return f"Moved to ({x}, {y})" if TRACE else None
 
 
 class GlideToRandomBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, secs: Union[int, "ScratchBlock"]):
-        super().__init__("motion_glideto_random", BlockType.STACK)
-        self.add_input("SECS", secs)
+        super().__init__(
+            "motion_glideto_random", BlockType.STACK, inputs={"SECS": secs}
+        )
 
     def execute(self, context):
-        secs = self.inputs["SECS"]
-        if isinstance(secs, ScratchBlock):
-            secs = secs.execute(context)
+        secs = self._resolved_inputs["SECS"](context)
 
         x = random.randint(-240, 240)
         y = random.randint(-180, 180)
         context["x"] = x
         context["y"] = y
-        return f"Glided to random position ({x}, {y}) in {secs} seconds"
+        return (
+            f"Glided to random position ({x}, {y}) in {secs} seconds" if TRACE else None
+        )
 
 
 class GlideToXYBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self,
         secs: Union[int, "ScratchBlock"],
         x: Union[int, "ScratchBlock"],
         y: Union[int, "ScratchBlock"],
     ):
-        super().__init__("motion_glidetoxy", BlockType.STACK)
-        self.add_input("SECS", secs)
-        self.add_input("X", x)
-        self.add_input("Y", y)
+        super().__init__(
+            "motion_glidetoxy", BlockType.STACK, inputs={"SECS": secs, "X": x, "Y": y}
+        )
 
     def execute(self, context):
-        secs = self.inputs["SECS"]
-        x = self.inputs["X"]
-        y = self.inputs["Y"]
-
-        if isinstance(secs, ScratchBlock):
-            secs = secs.execute(context)
-        if isinstance(x, ScratchBlock):
-            x = x.execute(context)
-        if isinstance(y, ScratchBlock):
-            y = y.execute(context)
+        secs = self._resolved_inputs["SECS"](context)
+        x = self._resolved_inputs["X"](context)
+        y = self._resolved_inputs["Y"](context)
 
         context["x"] = int(x)
         context["y"] = int(y)
-        return f"Glided to ({x}, {y}) in {secs} seconds"
+        return f"Glided to ({x}, {y}) in {secs} seconds" if TRACE else None
 
 
 class PointInDirectionBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, direction: Union[int, "ScratchBlock"]):
-        super().__init__("motion_pointindirection", BlockType.STACK)
-        self.add_input("DIRECTION", direction)
+        super().__init__(
+            "motion_pointindirection", BlockType.STACK, inputs={"DIRECTION": direction}
+        )
 
     def execute(self, context):
-        direction = self.inputs["DIRECTION"]
-        if isinstance(direction, ScratchBlock):
-            direction = direction.execute(context)
+        direction = self._resolved_inputs["DIRECTION"](context)
         context["direction"] = int(direction) % 360
-        return f"Pointed in direction {direction}"
+        return f"Pointed in direction {direction}" if TRACE else None
 
 
 class ChangeXByBlock(ScratchBlock):
+    __slots__ = ("_dx_int",)
+
     def __init__(self, dx: Union[int, "ScratchBlock"]):
-        super().__init__("motion_changexby", BlockType.STACK)
-        self.add_input("DX", dx)
+        super().__init__("motion_changexby", BlockType.STACK, inputs={"DX": dx})
+        self._dx_int = _literal_int(dx)
 
     def execute(self, context):
-        dx = self.inputs["DX"]
-        if isinstance(dx, ScratchBlock):
-            dx = dx.execute(context)
-        context["x"] = context.get("x", 0) + int(dx)
-        return f"Changed x by {dx}"
+        dx = self._resolved_inputs["DX"](context)
+        dx_int = self._dx_int if self._dx_int is not None else int(dx)
+        context["x"] = context["x"] + dx_int
+        return f"Changed x by {dx}" if TRACE else None
 
 
 class SetXToBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, x: Union[int, "ScratchBlock"]):
-        super().__init__("motion_setx", BlockType.STACK)
-        self.add_input("X", x)
+        super().__init__("motion_setx", BlockType.STACK, inputs={"X": x})
 
     def execute(self, context):
-        x = self.inputs["X"]
-        if isinstance(x, ScratchBlock):
-            x = x.execute(context)
+        x = self._resolved_inputs["X"](context)
         context["x"] = int(x)
-        return f"Set x to {x}"
+        return f"Set x to {x}" if TRACE else None
 
 
 class ChangeYByBlock(ScratchBlock):
+    __slots__ = ("_dy_int",)
+
     def __init__(self, dy: Union[int, "ScratchBlock"]):
-        super().__init__("motion_changeyby", BlockType.STACK)
-        self.add_input("DY", dy)
+        super().__init__("motion_changeyby", BlockType.STACK, inputs={"DY": dy})
+        self._dy_int = _literal_int(dy)
 
     def execute(self, context):
-        dy = self.inputs["DY"]
-        if isinstance(dy, ScratchBlock):
-            dy = dy.execute(context)
-        context["y"] = context.get("y", 0) + int(dy)
-        return f"Changed y by {dy}"
+        dy = self._resolved_inputs["DY"](context)
+        dy_int = self._dy_int if self._dy_int is not None else int(dy)
+        context["y"] = context["y"] + dy_int
+        return f"Changed y by {dy}" if TRACE else None
 
 
 class SetYToBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, y: Union[int, "ScratchBlock"]):
-        super().__init__("motion_sety", BlockType.STACK)
-        self.add_input("Y", y)
+        super().__init__("motion_sety", BlockType.STACK, inputs={"Y": y})
 
     def execute(self, context):
-        y = self.inputs["Y"]
-        if isinstance(y, ScratchBlock):
-            y = y.execute(context)
+        y = self._resolved_inputs["Y"](context)
         context["y"] = int(y)
-        return f"Set y to {y}"
+        return f"Set y to {y}" if TRACE else None
 
 
 class XPositionBlock(ScratchBlock):
+    __slots__ = ()
+    IS_IMPURE = True
+
     def __init__(self):
         super().__init__("motion_xposition", BlockType.REPORTER)
 
     def execute(self, context):
-        return context.get("x", 0)
+        return context["x"]
 
 
 class YPositionBlock(ScratchBlock):
+    __slots__ = ()
+    IS_IMPURE = True
+
     def __init__(self):
         super().__init__("motion_yposition", BlockType.REPORTER)
 
     def execute(self, context):
-        return context.get("y", 0)
+        return context["y"]
 
 
 class SayBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, message: Union[str, "ScratchBlock"]):
-        super().__init__("looks_say", BlockType.STACK)
-        self.add_input("MESSAGE", message)
+        super().__init__("looks_say", BlockType.STACK, inputs={"MESSAGE": message})
 
     def execute(self, context):
-        message = self.inputs["MESSAGE"]
-        if isinstance(message, ScratchBlock):
-            message = message.execute(context)
-        return f"Says: {message}"
+        message = self._resolved_inputs["MESSAGE"](context)
+        return f"Says: {message}" if TRACE else None
 
 
 class SayForSecsBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, message: Union[str, "ScratchBlock"], secs: Union[int, "ScratchBlock"]
     ):
-        super().__init__("looks_sayforsecs", BlockType.STACK)
-        self.add_input("MESSAGE", message)
-        self.add_input("SECS", secs)
+        super().__init__(
+            "looks_sayforsecs",
+            BlockType.STACK,
+            inputs={"MESSAGE": message, "SECS": secs},
+        )
 
     def execute(self, context):
-        message = self.inputs["MESSAGE"]
-        secs = self.inputs["SECS"]
-        if isinstance(message, ScratchBlock):
-            message = message.execute(context)
-        if isinstance(secs, ScratchBlock):
-            secs = secs.execute(context)
-        return f"Says '{message}' for {secs} seconds"
+        message = self._resolved_inputs["MESSAGE"](context)
+        secs = self._resolved_inputs["SECS"](context)
+        return f"Says '{message}' for {secs} seconds" if TRACE else None
 
 
 class ThinkBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, message: Union[str, "ScratchBlock"]):
-        super().__init__("looks_think", BlockType.STACK)
-        self.add_input("MESSAGE", message)
+        super().__init__("looks_think", BlockType.STACK, inputs={"MESSAGE": message})
 
     def execute(self, context):
-        message = self.inputs["MESSAGE"]
-        if isinstance(message, ScratchBlock):
-            message = message.execute(context)
-        return f"Thinks: {message}"
+        message = self._resolved_inputs["MESSAGE"](context)
+        return f"Thinks: {message}" if TRACE else None
 
 
 class ThinkForSecsBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, message: Union[str, "ScratchBlock"], secs: Union[int, "ScratchBlock"]
     ):
-        super().__init__("looks_thinkforsecs", BlockType.STACK)
-        self.add_input("MESSAGE", message)
-        self.add_input("SECS", secs)
+        super().__init__(
+            "looks_thinkforsecs",
+            BlockType.STACK,
+            inputs={"MESSAGE": message, "SECS": secs},
+        )
 
     def execute(self, context):
-        message = self.inputs["MESSAGE"]
-        secs = self.inputs["SECS"]
-        if isinstance(message, ScratchBlock):
-            message = message.execute(context)
-        if isinstance(secs, ScratchBlock):
-            secs = secs.execute(context)
-        return f"Thinks '{message}' for {secs} seconds"
+        message = self._resolved_inputs["MESSAGE"](context)
+        secs = self._resolved_inputs["SECS"](context)
+        return f"Thinks '{message}' for {secs} seconds" if TRACE else None
 
 
 class ChangeSizeByBlock(ScratchBlock):
+    __slots__ = ("_change_int",)
+
     def __init__(self, change: Union[int, "ScratchBlock"]):
-        super().__init__("looks_changesizeby", BlockType.STACK)
-        self.add_input("CHANGE", change)
+        super().__init__(
+            "looks_changesizeby", BlockType.STACK, inputs={"CHANGE": change}
+        )
+        self._change_int = _literal_int(change)
 
     def execute(self, context):
-        change = self.inputs["CHANGE"]
-        if isinstance(change, ScratchBlock):
-            change = change.execute(context)
-        context["size"] = context.get("size", 100) + int(change)
-        return f"Changed size by {change}"
+        change = self._resolved_inputs["CHANGE"](context)
+        change_int = self._change_int if self._change_int is not None else int(change)
+        context["size"] = context["size"] + change_int
+        return f"Changed size by {change}" if TRACE else None
 
 
 class SetSizeToBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, size: Union[int, "ScratchBlock"]):
-        super().__init__("looks_setsizeto", BlockType.STACK)
-        self.add_input("SIZE", size)
+        super().__init__("looks_setsizeto", BlockType.STACK, inputs={"SIZE": size})
 
     def execute(self, context):
-        size = self.inputs["SIZE"]
-        if isinstance(size, ScratchBlock):
-            size = size.execute(context)
+        size = self._resolved_inputs["SIZE"](context)
         context["size"] = int(size)
-        return f"Set size to {size}"
+        return f"Set size to {size}" if TRACE else None
 
 
 class WaitBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, secs: Union[int, "ScratchBlock"]):
-        super().__init__("control_wait", BlockType.STACK)
-        self.add_input("SECS", secs)
+        super().__init__("control_wait", BlockType.STACK, inputs={"SECS": secs})
 
     def execute(self, context):
-        secs = self.inputs["SECS"]
-        if isinstance(secs, ScratchBlock):
-            secs = secs.execute(context)
-        return f"Waited {secs} seconds"
+        secs = self._resolved_inputs["SECS"](context)
+        return f"Waited {secs} seconds" if TRACE else None
 
 
 class RepeatBlock(ScratchBlock):
+    __slots__ = ("substack", "_fns")
+
     def __init__(self, times: Union[int, "ScratchBlock"]):
-        super().__init__("control_repeat", BlockType.C_BLOCK)
-        self.add_input("TIMES", times)
+        super().__init__("control_repeat", BlockType.C_BLOCK, inputs={"TIMES": times})
         self.substack = []
+        # Bound execute methods of the substack, built on first execute
+        self._fns = None
 
     def add_to_substack(self, block: ScratchBlock):
         """Add a block to the repeat loop"""
         self.substack.append(block)
+        self._fns = None
         block.parent = self
-        self.children.append(block)
 
     def execute(self, context):
-        times = self.inputs["TIMES"]
-        if isinstance(times, ScratchBlock):
-            times = times.execute(context)
+        times = self._resolved_inputs["TIMES"](context)
 
-        results = []
-        for block in self.substack:
-            result = block.execute(context)
-            results.append(result)
-        return f"Repeated {times} times: {results}"
+        if self._fns is None:
+            self._fns = tuple(block.execute for block in self.substack)
+        results = _run_substack(self._fns, context)
+        return f"Repeated {times} times: {results}" if TRACE else None
 
 
 class ForeverBlock(ScratchBlock):
+    __slots__ = ("substack", "_fns")
+
     def __init__(self):
         super().__init__("control_forever", BlockType.C_BLOCK)
         self.substack = []
+        self._fns = None
 
     def add_to_substack(self, block: ScratchBlock):
         """Add a block to the forever loop"""
         self.substack.append(block)
+        self._fns = None
         block.parent = self
-        self.children.append(block)
 
     def execute(self, context):
-        results = []
-        for block in self.substack:
-            result = block.execute(context)
-            results.append(result)
-        return f"Forever loop: {results}"
+        if self._fns is None:
+            self._fns = tuple(block.execute for block in self.substack)
+        results = _run_substack(self._fns, context)
+        return f"Forever loop: {results}" if TRACE else None
 
 
 class IfBlock(ScratchBlock):
+    __slots__ = ("substack", "_fns")
+    BLOCK_INPUTS = frozenset({"CONDITION"})
+
     def __init__(self, condition: "ScratchBlock"):
-        super().__init__("control_if", BlockType.C_BLOCK)
-        self.add_input("CONDITION", condition)
+        super().__init__(
+            "control_if", BlockType.C_BLOCK, inputs={"CONDITION": condition}
+        )
         self.substack = []
+        self._fns = None
 
     def add_to_substack(self, block: ScratchBlock):
         """Add a block to the if statement"""
         self.substack.append(block)
+        self._fns = None
         block.parent = self
-        self.children.append(block)
 
     def execute(self, context):
-        condition = self.inputs["CONDITION"].execute(context)
+        condition = self._resolved_inputs["CONDITION"](context)
         if condition:
-            results = []
-            for block in self.substack:
-                result = block.execute(context)
-                results.append(result)
-            return f"If condition met: {results}"
-        return f"If condition not met (if the condition was met: {results})"
+            if self._fns is None:
+                self._fns = tuple(block.execute for block in self.substack)
+            results = _run_substack(self._fns, context)
+            return f"If condition met: {results}" if TRACE else None
+        return "If condition not met" if TRACE else None
 
 
 class IfElseBlock(ScratchBlock):
+    __slots__ = ("substack", "substack2", "_fns", "_else_fns")
+    BLOCK_INPUTS = frozenset({"CONDITION"})
+
     def __init__(self, condition: "ScratchBlock"):
-        super().__init__("control_if_else", BlockType.C_BLOCK)
-        self.add_input("CONDITION", condition)
+        super().__init__(
+            "control_if_else", BlockType.C_BLOCK, inputs={"CONDITION": condition}
+        )
         self.substack = []
+        self._fns = None
         self.substack2 = []
+        self._else_fns = None
 
     def add_to_substack(self, block: ScratchBlock):
         """Add a block to the if part"""
         self.substack.append(block)
+        self._fns = None
         block.parent = self
-        self.children.append(block)
 
     def add_to_else_substack(self, block: ScratchBlock):
         """Add a block to the else part"""
         self.substack2.append(block)
+        self._else_fns = None
         block.parent = self
-        self.children.append(block)
 
     def execute(self, context):
-        condition = self.inputs["CONDITION"].execute(context)
-        results_if = []
-        results_else = []
-
-        for block in self.substack:
-            result = block.execute(context)
-            results_if.append(result)
-        for block in self.substack2:
-            result = block.execute(context)
-            results_else.append(result)
-
+        condition = self._resolved_inputs["CONDITION"](context)
         if condition:
-            return f"If condition met: {results_if} (else: {results_else})"
+            if self._fns is None:
+                self._fns = tuple(block.execute for block in self.substack)
+            results_if = _run_substack(self._fns, context)
+            return f"If condition met: {results_if}" if TRACE else None
         else:
-            return f"Else condition met: {results_else} (if: {results_if})"
+            if self._else_fns is None:
+                self._else_fns = tuple(block.execute for block in self.substack2)
+            results_else = _run_substack(self._else_fns, context)
+            return f"Else condition met: {results_else}" if TRACE else None
 
 
 class WaitUntilBlock(ScratchBlock):
+    __slots__ = ()
+    BLOCK_INPUTS = frozenset({"CONDITION"})
+
     def __init__(self, condition: "ScratchBlock"):
-        super().__init__("control_wait_until", BlockType.STACK)
-        self.add_input("CONDITION", condition)
+        super().__init__(
+            "control_wait_until", BlockType.STACK, inputs={"CONDITION": condition}
+        )
 
     def execute(self, context):
         # Simplified - would actually wait until condition is true
-        condition = self.inputs["CONDITION"].execute(context)
-        return f"Waited until condition: {condition}"
+        condition = self._resolved_inputs["CONDITION"](context)
+        return f"Waited until condition: {condition}" if TRACE else None
 
 
 class RepeatUntilBlock(ScratchBlock):
+    __slots__ = ("substack", "_fns")
+    BLOCK_INPUTS = frozenset({"CONDITION"})
+
     def __init__(self, condition: "ScratchBlock"):
-        super().__init__("control_repeat_until", BlockType.C_BLOCK)
-        self.add_input("CONDITION", condition)
+        super().__init__(
+            "control_repeat_until", BlockType.C_BLOCK, inputs={"CONDITION": condition}
+        )
         self.substack = []
+        self._fns = None
 
     def add_to_substack(self, block: ScratchBlock):
         """Add a block to the repeat until loop"""
         self.substack.append(block)
+        self._fns = None
         block.parent = self
-        self.children.append(block)
 
     def execute(self, context):
-        results = []
-        for block in self.substack:
-            result = block.execute(context)
-            results.append(result)
-
-        return f"Repeat until {self.inputs['CONDITION']}: {results}"
+        if self._fns is None:
+            self._fns = tuple(block.execute for block in self.substack)
+        results = _run_substack(self._fns, context)
+        return f"Repeat until {self.inputs['CONDITION']}: {results}" if TRACE else None
 
 
 class StopBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, stop_option: str):
-        super().__init__("control_stop", BlockType.CAP)
-        self.add_field("STOP_OPTION", stop_option)
+        super().__init__(
+            "control_stop", BlockType.CAP, fields={"STOP_OPTION": stop_option}
+        )
 
     def execute(self, context):
-        return f"Stop {self.fields['STOP_OPTION']}"
+        return f"Stop {self.fields['STOP_OPTION']}" if TRACE else None
 
 
 class KeyPressedBlock(ScratchBlock):
+    __slots__ = ()
+    IS_IMPURE = True
+
     def __init__(self, key_option: str):
-        super().__init__("sensing_keypressed", BlockType.BOOLEAN)
-        self.add_field("KEY_OPTION", key_option)
+        super().__init__(
+            "sensing_keypressed", BlockType.BOOLEAN, fields={"KEY_OPTION": key_option}
+        )
 
     def execute(self, context):
         # Simplified - would check actual key state
@@ -540,6 +742,9 @@ class KeyPressedBlock(ScratchBlock):
 
 
 class MouseDownBlock(ScratchBlock):
+    __slots__ = ()
+    IS_IMPURE = True
+
     def __init__(self):
         super().__init__("sensing_mousedown", BlockType.BOOLEAN)
 
@@ -548,112 +753,118 @@ class MouseDownBlock(ScratchBlock):
 
 
 class AddBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, num1: Union[int, "ScratchBlock"], num2: Union[int, "ScratchBlock"]
     ):
-        super().__init__("operator_add", BlockType.REPORTER)
-        self.add_input("NUM1", num1)
-        self.add_input("NUM2", num2)
+        super().__init__(
+            "operator_add", BlockType.REPORTER, inputs={"NUM1": num1, "NUM2": num2}
+        )
 
     def execute(self, context):
-        num1 = self.inputs["NUM1"]
-        num2 = self.inputs["NUM2"]
-        if isinstance(num1, ScratchBlock):
-            num1 = num1.execute(context)
-        if isinstance(num2, ScratchBlock):
-            num2 = num2.execute(context)
+        num1 = self._resolved_inputs["NUM1"](context)
+        num2 = self._resolved_inputs["NUM2"](context)
+        # Nested arithmetic already yields floats, so skip the casts then
+        if num1.__class__ is float and num2.__class__ is float:
+            return num1 + num2
         return float(num1) + float(num2)
 
 
 class SubtractBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, num1: Union[int, "ScratchBlock"], num2: Union[int, "ScratchBlock"]
     ):
-        super().__init__("operator_subtract", BlockType.REPORTER)
-        self.add_input("NUM1", num1)
-        self.add_input("NUM2", num2)
+        super().__init__(
+            "operator_subtract", BlockType.REPORTER, inputs={"NUM1": num1, "NUM2": num2}
+        )
 
     def execute(self, context):
-        num1 = self.inputs["NUM1"]
-        num2 = self.inputs["NUM2"]
-        if isinstance(num1, ScratchBlock):
-            num1 = num1.execute(context)
-        if isinstance(num2, ScratchBlock):
-            num2 = num2.execute(context)
+        num1 = self._resolved_inputs["NUM1"](context)
+        num2 = self._resolved_inputs["NUM2"](context)
+        if num1.__class__ is float and num2.__class__ is float:
+            return num1 - num2
         return float(num1) - float(num2)
 
 
 class MultiplyBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, num1: Union[int, "ScratchBlock"], num2: Union[int, "ScratchBlock"]
     ):
-        super().__init__("operator_multiply", BlockType.REPORTER)
-        self.add_input("NUM1", num1)
-        self.add_input("NUM2", num2)
+        super().__init__(
+            "operator_multiply", BlockType.REPORTER, inputs={"NUM1": num1, "NUM2": num2}
+        )
 
     def execute(self, context):
-        num1 = self.inputs["NUM1"]
-        num2 = self.inputs["NUM2"]
-        if isinstance(num1, ScratchBlock):
-            num1 = num1.execute(context)
-        if isinstance(num2, ScratchBlock):
-            num2 = num2.execute(context)
+        num1 = self._resolved_inputs["NUM1"](context)
+        num2 = self._resolved_inputs["NUM2"](context)
+        if num1.__class__ is float and num2.__class__ is float:
+            return num1 * num2
         return float(num1) * float(num2)
 
 
 class DivideBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, num1: Union[int, "ScratchBlock"], num2: Union[int, "ScratchBlock"]
     ):
-        super().__init__("operator_divide", BlockType.REPORTER)
-        self.add_input("NUM1", num1)
-        self.add_input("NUM2", num2)
-
-    def execute(self, context):
-        num1 = self.inputs["NUM1"]
-        num2 = self.inputs["NUM2"]
-        if isinstance(num1, ScratchBlock):
-            num1 = num1.execute(context)
-        if isinstance(num2, ScratchBlock):
-            num2 = num2.execute(context)
-        if float(num2) == 0:
+        super().__init__(
+            "operator_divide", BlockType.REPORTER, inputs={"NUM1": num1, "NUM2": num2}
+        )
+
+    def execute(self, context):
+        num1 = self._resolved_inputs["NUM1"](context)
+        num2 = self._resolved_inputs["NUM2"](context)
+        if num2.__class__ is not float:
+            num2 = float(num2)
+        if num2 == 0:
             return float("inf")
-        return float(num1) / float(num2)
+        if num1.__class__ is not float:
+            num1 = float(num1)
+        return num1 / num2
 
 
 class RandomBlock(ScratchBlock):
+    __slots__ = ()
+    IS_IMPURE = True
+
     def __init__(
         self, from_num: Union[int, "ScratchBlock"], to_num: Union[int, "ScratchBlock"]
     ):
-        super().__init__("operator_random", BlockType.REPORTER)
-        self.add_input("FROM_NUM", from_num)
-        self.add_input("TO_NUM", to_num)
+        super().__init__(
+            "operator_random",
+            BlockType.REPORTER,
+            inputs={"FROM_NUM": from_num, "TO_NUM": to_num},
+        )
 
     def execute(self, context):
-        from_num = self.inputs["FROM_NUM"]
-        to_num = self.inputs["TO_NUM"]
-        if isinstance(from_num, ScratchBlock):
-            from_num = from_num.execute(context)
-        if isinstance(to_num, ScratchBlock):
-            to_num = to_num.execute(context)
+        from_num = self._resolved_inputs["FROM_NUM"](context)
+        to_num = self._resolved_inputs["TO_NUM"](context)
         return random.randint(int(from_num), int(to_num))
 
 
 class GreaterThanBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, operand1: Union[Any, "ScratchBlock"], operand2: Union[Any, "ScratchBlock"]
     ):
-        super().__init__("operator_gt", BlockType.BOOLEAN)
-        self.add_input("OPERAND1", operand1)
-        self.add_input("OPERAND2", operand2)
+        super().__init__(
+            "operator_gt",
+            BlockType.BOOLEAN,
+            inputs={"OPERAND1": operand1, "OPERAND2": operand2},
+        )
 
     def execute(self, context):
-        op1 = self.inputs["OPERAND1"]
-        op2 = self.inputs["OPERAND2"]
-        if isinstance(op1, ScratchBlock):
-            op1 = op1.execute(context)
-        if isinstance(op2, ScratchBlock):
-            op2 = op2.execute(context)
+        op1 = self._resolved_inputs["OPERAND1"](context)
+        op2 = self._resolved_inputs["OPERAND2"](context)
+        if op1.__class__ is float and op2.__class__ is float:
+            return op1 > op2
         try:
             return float(op1) > float(op2)
         except ValueError:
@@ -661,20 +872,22 @@ class GreaterThanBlock(ScratchBlock):
 
 
 class LessThanBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, operand1: Union[Any, "ScratchBlock"], operand2: Union[Any, "ScratchBlock"]
     ):
-        super().__init__("operator_lt", BlockType.BOOLEAN)
-        self.add_input("OPERAND1", operand1)
-        self.add_input("OPERAND2", operand2)
+        super().__init__(
+            "operator_lt",
+            BlockType.BOOLEAN,
+            inputs={"OPERAND1": operand1, "OPERAND2": operand2},
+        )
 
     def execute(self, context):
-        op1 = self.inputs["OPERAND1"]
-        op2 = self.inputs["OPERAND2"]
-        if isinstance(op1, ScratchBlock):
-            op1 = op1.execute(context)
-        if isinstance(op2, ScratchBlock):
-            op2 = op2.execute(context)
+        op1 = self._resolved_inputs["OPERAND1"](context)
+        op2 = self._resolved_inputs["OPERAND2"](context)
+        if op1.__class__ is float and op2.__class__ is float:
+            return op1 < op2
         try:
             return float(op1) < float(op2)
         except ValueError:
@@ -682,90 +895,102 @@ class LessThanBlock(ScratchBlock):
 
 
 class EqualsBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, operand1: Union[Any, "ScratchBlock"], operand2: Union[Any, "ScratchBlock"]
     ):
-        super().__init__("operator_equals", BlockType.BOOLEAN)
-        self.add_input("OPERAND1", operand1)
-        self.add_input("OPERAND2", operand2)
+        super().__init__(
+            "operator_equals",
+            BlockType.BOOLEAN,
+            inputs={"OPERAND1": operand1, "OPERAND2": operand2},
+        )
 
     def execute(self, context):
-        op1 = self.inputs["OPERAND1"]
-        op2 = self.inputs["OPERAND2"]
-        if isinstance(op1, ScratchBlock):
-            op1 = op1.execute(context)
-        if isinstance(op2, ScratchBlock):
-            op2 = op2.execute(context)
+        op1 = self._resolved_inputs["OPERAND1"](context)
+        op2 = self._resolved_inputs["OPERAND2"](context)
         return op1 == op2
 
 
 class AndBlock(ScratchBlock):
+    __slots__ = ()
+    BLOCK_INPUTS = frozenset({"OPERAND1", "OPERAND2"})
+
     def __init__(self, operand1: "ScratchBlock", operand2: "ScratchBlock"):
-        super().__init__("operator_and", BlockType.BOOLEAN)
-        self.add_input("OPERAND1", operand1)
-        self.add_input("OPERAND2", operand2)
+        super().__init__(
+            "operator_and",
+            BlockType.BOOLEAN,
+            inputs={"OPERAND1": operand1, "OPERAND2": operand2},
+        )
 
     def execute(self, context):
-        op1 = self.inputs["OPERAND1"].execute(context)
-        op2 = self.inputs["OPERAND2"].execute(context)
+        op1 = self._resolved_inputs["OPERAND1"](context)
+        op2 = self._resolved_inputs["OPERAND2"](context)
         return bool(op1) and bool(op2)
 
 
 class OrBlock(ScratchBlock):
+    __slots__ = ()
+    BLOCK_INPUTS = frozenset({"OPERAND1", "OPERAND2"})
+
     def __init__(self, operand1: "ScratchBlock", operand2: "ScratchBlock"):
-        super().__init__("operator_or", BlockType.BOOLEAN)
-        self.add_input("OPERAND1", operand1)
-        self.add_input("OPERAND2", operand2)
+        super().__init__(
+            "operator_or",
+            BlockType.BOOLEAN,
+            inputs={"OPERAND1": operand1, "OPERAND2": operand2},
+        )
 
     def execute(self, context):
-        op1 = self.inputs["OPERAND1"].execute(context)
-        op2 = self.inputs["OPERAND2"].execute(context)
+        op1 = self._resolved_inputs["OPERAND1"](context)
+        op2 = self._resolved_inputs["OPERAND2"](context)
         return bool(op1) or bool(op2)
 
 
 class NotBlock(ScratchBlock):
+    __slots__ = ()
+    BLOCK_INPUTS = frozenset({"OPERAND"})
+
     def __init__(self, operand: "ScratchBlock"):
-        super().__init__("operator_not", BlockType.BOOLEAN)
-        self.add_input("OPERAND", operand)
+        super().__init__("operator_not", BlockType.BOOLEAN, inputs={"OPERAND": operand})
 
     def execute(self, context):
-        op = self.inputs["OPERAND"].execute(context)
+        op = self._resolved_inputs["OPERAND"](context)
         return not bool(op)
 
 
 class JoinBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, string1: Union[str, "ScratchBlock"], string2: Union[str, "ScratchBlock"]
     ):
-        super().__init__("operator_join", BlockType.REPORTER)
-        self.add_input("STRING1", string1)
-        self.add_input("STRING2", string2)
+        super().__init__(
+            "operator_join",
+            BlockType.REPORTER,
+            inputs={"STRING1": string1, "STRING2": string2},
+        )
 
     def execute(self, context):
-        str1 = self.inputs["STRING1"]
-        str2 = self.inputs["STRING2"]
-        if isinstance(str1, ScratchBlock):
-            str1 = str1.execute(context)
-        if isinstance(str2, ScratchBlock):
-            str2 = str2.execute(context)
+        str1 = self._resolved_inputs["STRING1"](context)
+        str2 = self._resolved_inputs["STRING2"](context)
         return str(str1) + str(str2)
 
 
 class LetterOfBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, letter_num: Union[int, "ScratchBlock"], string: Union[str, "ScratchBlock"]
     ):
-        super().__init__("operator_letter_of", BlockType.REPORTER)
-        self.add_input("LETTER_NUM", letter_num)
-        self.add_input("STRING", string)
+        super().__init__(
+            "operator_letter_of",
+            BlockType.REPORTER,
+            inputs={"LETTER_NUM": letter_num, "STRING": string},
+        )
 
     def execute(self, context):
-        letter_num = self.inputs["LETTER_NUM"]
-        string = self.inputs["STRING"]
-        if isinstance(letter_num, ScratchBlock):
-            letter_num = letter_num.execute(context)
-        if isinstance(string, ScratchBlock):
-            string = string.execute(context)
+        letter_num = self._resolved_inputs["LETTER_NUM"](context)
+        string = self._resolved_inputs["STRING"](context)
 
         string = str(string)
         letter_num = int(letter_num)
@@ -776,161 +1001,173 @@ class LetterOfBlock(ScratchBlock):
 
 
 class LengthOfBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, string: Union[str, "ScratchBlock"]):
-        super().__init__("operator_length", BlockType.REPORTER)
-        self.add_input("STRING", string)
+        super().__init__(
+            "operator_length", BlockType.REPORTER, inputs={"STRING": string}
+        )
 
     def execute(self, context):
-        string = self.inputs["STRING"]
-        if isinstance(string, ScratchBlock):
-            string = string.execute(context)
+        string = self._resolved_inputs["STRING"](context)
         return len(str(string))
 
 
 class ContainsBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, string1: Union[str, "ScratchBlock"], string2: Union[str, "ScratchBlock"]
     ):
-        super().__init__("operator_contains", BlockType.BOOLEAN)
-        self.add_input("STRING1", string1)
-        self.add_input("STRING2", string2)
+        super().__init__(
+            "operator_contains",
+            BlockType.BOOLEAN,
+            inputs={"STRING1": string1, "STRING2": string2},
+        )
 
     def execute(self, context):
-        str1 = self.inputs["STRING1"]
-        str2 = self.inputs["STRING2"]
-        if isinstance(str1, ScratchBlock):
-            str1 = str1.execute(context)
-        if isinstance(str2, ScratchBlock):
-            str2 = str2.execute(context)
+        str1 = self._resolved_inputs["STRING1"](context)
+        str2 = self._resolved_inputs["STRING2"](context)
         return str(str2) in str(str1)
 
 
 class ModBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(
         self, num1: Union[int, "ScratchBlock"], num2: Union[int, "ScratchBlock"]
     ):
-        super().__init__("operator_mod", BlockType.REPORTER)
-        self.add_input("NUM1", num1)
-        self.add_input("NUM2", num2)
-
-    def execute(self, context):
-        num1 = self.inputs["NUM1"]
-        num2 = self.inputs["NUM2"]
-        if isinstance(num1, ScratchBlock):
-            num1 = num1.execute(context)
-        if isinstance(num2, ScratchBlock):
-            num2 = num2.execute(context)
-        if float(num2) == 0:
+        super().__init__(
+            "operator_mod", BlockType.REPORTER, inputs={"NUM1": num1, "NUM2": num2}
+        )
+
+    def execute(self, context):
+        num1 = self._resolved_inputs["NUM1"](context)
+        num2 = self._resolved_inputs["NUM2"](context)
+        if num2.__class__ is not float:
+            num2 = float(num2)
+        if num2 == 0:
             return float("nan")
-        return float(num1) % float(num2)
+        if num1.__class__ is not float:
+            num1 = float(num1)
+        return num1 % num2
 
 
 class RoundBlock(ScratchBlock):
+    __slots__ = ()
+
     def __init__(self, num: Union[float, "ScratchBlock"]):
-        super().__init__("operator_round", BlockType.REPORTER)
-        self.add_input("NUM", num)
+        super().__init__("operator_round", BlockType.REPORTER, inputs={"NUM": num})
 
     def execute(self, context):
-        num = self.inputs["NUM"]
-        if isinstance(num, ScratchBlock):
-            num = num.execute(context)
+        num = self._resolved_inputs["NUM"](context)
         return round(float(num))
 
 
+# Scratch's trig functions take and return degrees
+_MATH_OPS = {
+    "abs": abs,
+    "floor": math.floor,
+    "ceiling": math.ceil,
+    "sqrt": math.sqrt,
+    "sin": lambda num: math.sin(math.radians(num)),
+    "cos": lambda num: math.cos(math.radians(num)),
+    "tan": lambda num: math.tan(math.radians(num)),
+    "asin": lambda num: math.degrees(math.asin(num)),
+    "acos": lambda num: math.degrees(math.acos(num)),
+    "atan": lambda num: math.degrees(math.atan(num)),
+    "ln": math.log,
+    "log": math.log10,
+    "e ^": math.exp,
+    "10 ^": lambda num: 10**num,
+}
+
+
 class MathFunctionBlock(ScratchBlock):
+    __slots__ = ("_op_fn",)
+
     def __init__(self, operator: str, num: Union[float, "ScratchBlock"]):
-        super().__init__("operator_mathop", BlockType.REPORTER)
-        self.add_field("OPERATOR", operator)
-        self.add_input("NUM", num)
+        super().__init__(
+            "operator_mathop",
+            BlockType.REPORTER,
+            inputs={"NUM": num},
+            fields={"OPERATOR": operator},
+        )
+        # Unknown operators pass the number through unchanged
+        self._op_fn = _MATH_OPS.get(operator, lambda num: num)
 
     def execute(self, context):
-        num = self.inputs["NUM"]
-        if isinstance(num, ScratchBlock):
-            num = num.execute(context)
-
-        num = float(num)
-        operator = self.fields["OPERATOR"]
+        num = float(self._resolved_inputs["NUM"](context))
 
         try:
-            if operator == "abs":
-                return abs(num)
-            elif operator == "floor":
-                return math.floor(num)
-            elif operator == "ceiling":
-                return math.ceil(num)
-            elif operator == "sqrt":
-                return math.sqrt(num)
-            elif operator == "sin":
-                return math.sin(math.radians(num))
-            elif operator == "cos":
-                return math.cos(math.radians(num))
-            elif operator == "tan":
-                return math.tan(math.radians(num))
-            elif operator == "asin":
-                return math.degrees(math.asin(num))
-            elif operator == "acos":
-                return math.degrees(math.acos(num))
-            elif operator == "atan":
-                return math.degrees(math.atan(num))
-            elif operator == "ln":
-                return math.log(num)
-            elif operator == "log":
-                return math.log10(num)
-            elif operator == "e ^":
-                return math.exp(num)
-            elif operator == "10 ^":
-                return 10**num
-            else:
-                return num
+            return self._op_fn(num)
         except (ValueError, ZeroDivisionError):
             return float("nan")
 
 
 class SetVariableBlock(ScratchBlock):
+    __slots__ = ("_var_key",)
+
     def __init__(self, variable: str, value: Union[Any, "ScratchBlock"]):
-        super().__init__("data_setvariableto", BlockType.STACK)
-        self.add_field("VARIABLE", variable)
-        self.add_input("VALUE", value)
+        super().__init__(
+            "data_setvariableto",
+            BlockType.STACK,
+            inputs={"VALUE": value},
+            fields={"VARIABLE": variable},
+        )
+        self._var_key = f"var_{variable}"
 
     def execute(self, context):
-        var_name = self.fields["VARIABLE"]
-        value = self.inputs["VALUE"]
-        if isinstance(value, ScratchBlock):
-            value = value.execute(context)
-        context[f"var_{var_name}"] = value
-        return f"Set {var_name} to {value}"
+        value = self._resolved_inputs["VALUE"](context)
+        context[self._var_key] = value
+        return f"Set {self.fields['VARIABLE']} to {value}" if TRACE else None
 
 
 class ChangeVariableByBlock(ScratchBlock):
+    __slots__ = ("_var_key",)
+
     def __init__(self, variable: str, value: Union[Any, "ScratchBlock"]):
-        super().__init__("data_changevariableby", BlockType.STACK)
-        self.add_field("VARIABLE", variable)
-        self.add_input("VALUE", value)
+        super().__init__(
+            "data_changevariableby",
+            BlockType.STACK,
+            inputs={"VALUE": value},
+            fields={"VARIABLE": variable},
+        )
+        self._var_key = f"var_{variable}"
 
     def execute(self, context):
-        var_name = self.fields["VARIABLE"]
-        value = self.inputs["VALUE"]
-        if isinstance(value, ScratchBlock):
-            value = value.execute(context)
-
-        current_value = context.get(f"var_{var_name}", 0)
-        try:
-            new_value = float(current_value) + float(value)
-        except ValueError:
-            new_value = str(current_value) + str(value)
+        value = self._resolved_inputs["VALUE"](context)
+
+        key = self._var_key
+        current_value = context.get(key, 0)
+        # After the first change the variable holds a float, and adding an int
+        # or float to it already equals the cast sum
+        if current_value.__class__ is float and (
+            value.__class__ is float or value.__class__ is int
+        ):
+            new_value = current_value + value
+        else:
+            try:
+                new_value = float(current_value) + float(value)
+            except ValueError:
+                new_value = str(current_value) + str(value)
 
-        context[f"var_{var_name}"] = new_value
-        return f"Changed {var_name} by {value}"
+        context[key] = new_value
+        return f"Changed {self.fields['VARIABLE']} by {value}" if TRACE else None
 
 
 class GetVariableBlock(ScratchBlock):
+    __slots__ = ("_var_key",)
+    IS_IMPURE = True
+
     def __init__(self, variable: str):
-        super().__init__("data_variable", BlockType.REPORTER)
-        self.add_field("VARIABLE", variable)
+        super().__init__(
+            "data_variable", BlockType.REPORTER, fields={"VARIABLE": variable}
+        )
+        self._var_key = f"var_{variable}"
 
     def execute(self, context):
-        var_name = self.fields["VARIABLE"]
-        return context.get(f"var_{var_name}", 0)
+        return context.get(self._var_key, 0)
 
 
 class ScratchProgram:
@@ -939,6 +1176,7 @@ class ScratchProgram:
     def __init__(self):
         self.blocks = {}
         self.scripts = []
+        self.script_chains = []
 
     def add_block(self, block: ScratchBlock):
         """Add a block to the program"""
@@ -947,76 +1185,74 @@ class ScratchProgram:
     def add_script(self, start_block: ScratchBlock):
         """Add a script (starting with a hat block)"""
         self.scripts.append(start_block)
+        self.script_chains.append(self._flatten_chain(start_block))
         self._add_connected_blocks(start_block)
 
-    def _add_connected_blocks(self, block: ScratchBlock):
-        """Recursively add all connected blocks"""
-        self.add_block(block)
-
-        if block.next_block:
-            self._add_connected_blocks(block.next_block)
-
-        for child in block.children:
-            self._add_connected_blocks(child)
-
-        if hasattr(block, "substack"):
-            for subblock in block.substack:
-                self._add_connected_blocks(subblock)
-
-        if hasattr(block, "substack2"):
-            for subblock in block.substack2:
-                self._add_connected_blocks(subblock)
-
-    def _collect_connected_blocks(self, block: ScratchBlock, connected_blocks: set):
-        """Recursively collect all blocks connected to a given block"""
-        if block.id in connected_blocks:
-            return
-
-        connected_blocks.add(block.id)
-
-        if block.next_block:
-            self._collect_connected_blocks(block.next_block, connected_blocks)
+    def _flatten_chain(self, block: ScratchBlock) -> List[ScratchBlock]:
+        """List the blocks reached by following next_block from block"""
+        chain = []
+        seen = set()
+        while block and block.id not in seen:
+            seen.add(block.id)
+            chain.append(block)
+            block = block.next_block
+        return chain
 
-        for child in block.children:
-            self._collect_connected_blocks(child, connected_blocks)
-
-        if hasattr(block, "substack"):
-            for subblock in block.substack:
-                self._collect_connected_blocks(subblock, connected_blocks)
+    def _add_connected_blocks(self, block: ScratchBlock):
+        """Add all connected blocks, in the same preorder as a recursive walk"""
+        visited = set()
+        self._collect_connected_blocks(block, visited, self.add_block)
 
-        if hasattr(block, "substack2"):
-            for subblock in block.substack2:
-                self._collect_connected_blocks(subblock, connected_blocks)
+    def _collect_connected_blocks(
+        self,
+        block: ScratchBlock,
+        connected_blocks: set,
+        visit: Optional[Callable[[ScratchBlock], Any]] = None,
+    ):
+        """Collect the ids of all blocks connected to a given block, calling
+        visit on each one in preorder (next block first, then children)"""
+        # Explicit stack rather than recursion, so long scripts cannot hit the
+        # recursion limit; pushing in reverse keeps the recursive visit order
+        stack = [block]
+        while stack:
+            block = stack.pop()
+            if block.id in connected_blocks:
+                continue
+            connected_blocks.add(block.id)
+            if visit is not None:
+                visit(block)
+
+            stack.extend(reversed(block.children))
+            if block.next_block:
+                stack.append(block.next_block)
 
     def execute(self, context: Optional[Dict[str, Any]] = None):
         """Execute all scripts in the program"""
         if context is None:
-            context = {"x": 0, "y": 0, "direction": 0, "size": 100}
+            context = make_context()
 
         results = []
-        for script in self.scripts:
-            result = self._execute_script(script, context)
+        for chain in self.script_chains:
+            result = self._execute_script(chain, context)
             results.append(result)
 
         return results, context
 
-    def _execute_script(self, block: ScratchBlock, context: Dict[str, Any]):
-        """Execute a script starting from a given block"""
-        results = []
-        current_block = block
-
-        while current_block:
-            result = current_block.execute(context)
-            results.append(result)
-            current_block = current_block.next_block
+    def _execute_script(self, chain: List[ScratchBlock], context: Dict[str, Any]):
+        """Execute a script's flattened chain of blocks"""
+        if not TRACE:
+            for block in chain:
+                block.execute(context)
+            return None
 
-        return results
+        return [block.execute(context) for block in chain]
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert program to dictionary representation"""
         return {
             "blocks": {
-                block_id: block.to_dict() for block_id, block in self.blocks.items()
+                str(block_id): block.to_dict()
+                for block_id, block in self.blocks.items()
             },
-            "scripts": [script.id for script in self.scripts],
+            "scripts": [str(script.id) for script in self.scripts],
         }
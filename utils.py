@@ -1,5 +1,14 @@
+import os
 import json
-from collections import defaultdict, deque
+import hashlib
+import itertools
+import orjson
+import threading
+from pathlib import Path
+from functools import lru_cache
+from collections import defaultdict
+
+CACHE_DIR = Path(".llm_cache")
 
 
 def topological_sort(graph_data):
@@ -7,11 +16,9 @@ def topological_sort(graph_data):
     edges = graph_data["edges"]
 
     adj_list = defaultdict(list)
+    # Nodes without incoming edges default to an in-degree of 0
     in_degree = defaultdict(int)
 
-    for node_id in nodes:
-        in_degree[node_id] = 0
-
     for edge in edges:
         out_node = edge["outNodeID"]
         in_node = edge["inNodeID"]
@@ -19,21 +26,17 @@ def topological_sort(graph_data):
         adj_list[out_node].append(in_node)
         in_degree[in_node] += 1
 
-    queue = deque()
-    for node_id in nodes:
-        if in_degree[node_id] == 0:
-            queue.append(node_id)
-
-    result = []
-
-    while queue:
-        current = queue.popleft()
-        result.append(current)
+    # A list read front to back is still a FIFO queue (the for loop picks up
+    # nodes appended during iteration), without deque.popleft; the order
+    # decides which hat block main.py registers, so it must not change
+    result = [node_id for node_id in nodes if in_degree[node_id] == 0]
 
+    for current in result:
         for neighbor in adj_list[current]:
-            in_degree[neighbor] -= 1
-            if in_degree[neighbor] == 0:
-                queue.append(neighbor)
+            degree = in_degree[neighbor] - 1
+            in_degree[neighbor] = degree
+            if degree == 0:
+                result.append(neighbor)
 
     if len(result) != len(nodes):
         raise ValueError("Error: Graph is not a DAG")
@@ -44,12 +47,30 @@ def topological_sort(graph_data):
 def convert_repr(agent_b_graph, node_reference):
     agent_a_graph = {"nodes": {}, "edges": []}
 
+    # (schema name, port id) -> "out" for output ports, "in" for input ports
+    # and fields; no schema uses one id for both
+    port_role = {}
+    for name, schema in node_reference.items():
+        for port in schema.get("inPorts", []):
+            port_role[name, port["id"]] = "in"
+        for field in schema.get("fields", []):
+            port_role[name, field["id"]] = "in"
+        for port in schema.get("outPorts", []):
+            port_role[name, port["id"]] = "out"
+
     for node_id, node_data in agent_b_graph.items():
         agent_a_graph["nodes"][node_id] = {
             "name": node_data["nodeName"],
             "value": node_data.get("value", None),
         }
 
+    # (node, neighbour) -> the neighbour's port facing node; if the neighbour
+    # lists several edges to node, the first one wins
+    reverse_port = {}
+    for nid, nd in agent_b_graph.items():
+        for e in nd.get("edges", []):
+            reverse_port.setdefault((e["otherNodeID"], nid), e["portID"])
+
     processed_edge_pairs = set()
 
     for node_id, node_data in agent_b_graph.items():
@@ -61,24 +82,21 @@ def convert_repr(agent_b_graph, node_reference):
         for edge in node_data.get("edges", []):
             port_id = edge["portID"]
             other_node_id = edge["otherNodeID"]
-            other_node_data = agent_b_graph[other_node_id]
-            other_node_name = other_node_data["nodeName"]
-
-            other_port_id = ""
-            for other_edge in other_node_data.get("edges", []):
-                if other_edge["otherNodeID"] == node_id:
-                    other_port_id = other_edge["portID"]
-                    break
+            other_port_id = reverse_port.get((node_id, other_node_id), "")
 
-            connection_id = tuple(
-                sorted([(node_id, port_id), (other_node_id, other_port_id)])
-            )
+            # Both endpoints usually list the connection; drop the second
+            # sighting before doing any more work for it
+            end_a = (node_id, port_id)
+            end_b = (other_node_id, other_port_id)
+            connection_id = (end_a, end_b) if end_a <= end_b else (end_b, end_a)
 
             if connection_id in processed_edge_pairs:
                 continue
 
             processed_edge_pairs.add(connection_id)
 
+            other_node_name = agent_b_graph[other_node_id]["nodeName"]
+
             if node_name == "Constant":
                 out_node_id, out_port_id, in_node_id, in_port_id = (
                     node_id,
@@ -94,49 +112,28 @@ def convert_repr(agent_b_graph, node_reference):
                     port_id,
                 )
             else:
-                node1_schema = node_reference.get(node_name, {})
-                node2_schema = node_reference.get(other_node_name, {})
-
-                out_ports = node1_schema.get("outPorts", [])
-                node1_port_is_output = any(port["id"] == port_id for port in out_ports)
+                role1 = port_role.get((node_name, port_id))
+                role2 = port_role.get((other_node_name, other_port_id))
 
-                in_ports = node2_schema.get("inPorts", [])
-                fields = node2_schema.get("fields", [])
-                node2_port_is_input = any(
-                    port["id"] == other_port_id for port in in_ports
-                ) or any(field["id"] == other_port_id for field in fields)
-
-                if node1_port_is_output and node2_port_is_input:
+                if role1 == "out" and role2 == "in":
                     out_node_id, out_port_id, in_node_id, in_port_id = (
                         node_id,
                         port_id,
                         other_node_id,
                         other_port_id,
                     )
+                elif role2 == "out" and role1 == "in":
+                    out_node_id, out_port_id, in_node_id, in_port_id = (
+                        other_node_id,
+                        other_port_id,
+                        node_id,
+                        port_id,
+                    )
                 else:
-                    out_ports_2 = node2_schema.get("outPorts", [])
-                    node2_port_is_output = any(
-                        port["id"] == other_port_id for port in out_ports_2
+                    raise ValueError(
+                        f"Could not determine edge direction between {node_name}.{port_id if port_id else 'undefined'} and {other_node_name}.{other_port_id if other_port_id else 'undefined'}"
                     )
 
-                    in_ports_1 = node1_schema.get("inPorts", [])
-                    fields_1 = node1_schema.get("fields", [])
-                    node1_port_is_input = any(
-                        port["id"] == port_id for port in in_ports_1
-                    ) or any(field["id"] == port_id for field in fields_1)
-
-                    if node2_port_is_output and node1_port_is_input:
-                        out_node_id, out_port_id, in_node_id, in_port_id = (
-                            other_node_id,
-                            other_port_id,
-                            node_id,
-                            port_id,
-                        )
-                    else:
-                        raise ValueError(
-                            f"Could not determine edge direction between {node_name}.{port_id if port_id else 'undefined'} and {other_node_name}.{other_port_id if other_port_id else 'undefined'}"
-                        )
-
             agent_a_edge = {
                 "outNodeID": out_node_id,
                 "outPortID": out_port_id,
@@ -149,62 +146,92 @@ def convert_repr(agent_b_graph, node_reference):
     return agent_a_graph
 
 
+def cached_completion(create, params):
+    key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    path = CACHE_DIR / f"{key}.json"
+
+    if path.exists():
+        with open(path) as f:
+            return json.load(f)["content"]
+
+    content = create(**params).choices[0].message.content
+
+    # Write then rename so concurrent workers never read a partial entry
+    CACHE_DIR.mkdir(exist_ok=True)
+    tmp_path = CACHE_DIR / f"{key}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"content": content}, f)
+    os.replace(tmp_path, path)
+
+    return content
+
+
+@lru_cache(maxsize=1)
 def get_reference_proposed():
-    with open("ref-nodes/proposed.json") as f:
-        reference = json.load(f)
+    with open("ref-nodes/proposed.json", "rb") as f:
+        reference = orjson.loads(f.read())
     return reference
 
 
+@lru_cache(maxsize=1)
 def get_reference_extra_desc():
-    with open("ref-nodes/extra-desc.json") as f:
-        reference = json.load(f)
+    with open("ref-nodes/extra-desc.json", "rb") as f:
+        reference = orjson.loads(f.read())
     return reference
 
 
+@lru_cache(maxsize=1)
 def get_reference_no_types():
-    with open("ref-nodes/no-types.json") as f:
-        reference = json.load(f)
+    with open("ref-nodes/no-types.json", "rb") as f:
+        reference = orjson.loads(f.read())
     return reference
 
 
-def get_arg_val(id, port_id, edges):
+def build_edge_index(edges):
+    # by_out lists each node's outgoing edges; by_in maps an input port to the
+    # node feeding it (the first such edge wins, as with a linear scan)
+    by_out = defaultdict(list)
+    by_in = {}
     for e in edges:
-        if e["inNodeID"] == id and e["inPortID"] == port_id:
-            return e["outNodeID"]
+        by_out[e["outNodeID"]].append(e)
+        by_in.setdefault((e["inNodeID"], e["inPortID"]), e["outNodeID"])
+    return by_out, by_in
 
 
-def get_substack_blocks(id, edges):
-    blocks = []
-    for e in edges:
-        if e["outNodeID"] == id and (
-            e["outPortID"] == "SUBSTACK" or e["outPortID"] == "SUBSTACK_IF"
-        ):
-            blocks.extend(get_execution_chain(e["inNodeID"], edges))
-    return blocks
+def get_arg_val(id, port_id, by_in):
+    return by_in.get((id, port_id))
 
 
-def get_substackelse_blocks(id, edges):
-    blocks = []
-    for e in edges:
-        if e["outNodeID"] == id and e["outPortID"] == "SUBSTACK_ELSE":
-            blocks.extend(get_execution_chain(e["inNodeID"], edges))
-    return blocks
+_SUBSTACK_PORTS = frozenset({"SUBSTACK", "SUBSTACK_IF"})
+
+
+def get_substack_blocks(id, by_out, exec_map):
+    return list(
+        itertools.chain.from_iterable(
+            get_execution_chain(e["inNodeID"], exec_map)
+            for e in by_out.get(id, ())
+            if e["outPortID"] in _SUBSTACK_PORTS
+        )
+    )
 
 
-def get_execution_chain(id, edges):
-    exec_map = {}
+def get_substackelse_blocks(id, by_out, exec_map):
+    return list(
+        itertools.chain.from_iterable(
+            get_execution_chain(e["inNodeID"], exec_map)
+            for e in by_out.get(id, ())
+            if e["outPortID"] == "SUBSTACK_ELSE"
+        )
+    )
 
-    for conn in edges:
-        if conn["outPortID"] == "THEN" and conn["inPortID"] == "EXEC":
-            exec_map[conn["outNodeID"]] = conn["inNodeID"]
 
-    chain = []
+def get_execution_chain(id, exec_map):
+    # An insertion-ordered dict is both the chain and its cycle check
+    chain = {}
     current_node = id
-    visited = set()
 
-    while current_node is not None and current_node not in visited:
-        chain.append(current_node)
-        visited.add(current_node)
+    while current_node is not None and current_node not in chain:
+        chain[current_node] = None
         current_node = exec_map.get(current_node)
 
-    return chain
+    return list(chain)